@@ -1,14 +1,20 @@
 import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore
-import json
-from google.oauth2 import service_account
+from google.api_core.exceptions import AlreadyExists, NotFound
+import orjson
 import bcrypt
-from datetime import datetime, timedelta
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from datetime import date, timedelta
+import hashlib
+import hmac
+import html
 import os
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 # Configurações iniciais para uma aparência de tela cheia e um ícone personalizado.
@@ -20,189 +26,381 @@ st.set_page_config(
 
 # --- CSS CUSTOMIZADO PARA UMA UI/UX PREMIUM ---
 # Esta seção injeta um CSS complexo para transformar completamente a aparência do Streamlit.
-def load_custom_css():
-    st.markdown("""
-        <style>
-            /* --- FONTES E TEMA GERAL --- */
-            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;700&display=swap');
-            
-            html, body, [class*="st-"] {
-                font-family: 'Inter', sans-serif;
-            }
-
-            .stApp {
-                background-color: #121212; /* Fundo escuro profundo */
-                color: #E0E0E0;
-            }
-
-            h1, h2, h3, h4, h5, h6 {
-                color: #FFFFFF !important;
-                font-weight: 700;
-            }
-
-            /* --- SIDEBAR --- */
-            [data-testid="stSidebar"] {
-                background-color: #1E1E1E;
-                border-right: 1px solid #2A2A2A;
-            }
-
-            /* --- ABAS DE NAVEGAÇÃO --- */
-            .stTabs [data-baseweb="tab-list"] {
-                gap: 24px;
-                border-bottom: 1px solid #2A2A2A;
-            }
-            .stTabs [data-baseweb="tab"] {
-                padding: 12px 16px;
-                background-color: transparent;
-                border: none;
-                color: #A0A0A0;
-                font-weight: 500;
-                transition: all 0.2s ease-in-out;
-            }
-            .stTabs [data-baseweb="tab"]:hover {
-                color: #FFFFFF;
-                background-color: #2A2A2A;
-            }
-            .stTabs [aria-selected="true"] {
-                color: #FFFFFF;
-                border-bottom: 3px solid #00A86B; /* Verde como cor de destaque */
-            }
-
-            /* --- CARDS E CONTAINERS --- */
-            .st-emotion-cache-1r6slb0, [data-testid="stForm"] {
-                background-color: #1E1E1E;
-                border: 1px solid #2A2A2A;
-                border-radius: 12px;
-                padding: 24px;
-                transition: box-shadow 0.3s ease, transform 0.2s ease;
-            }
-            .st-emotion-cache-1r6slb0:hover {
-                box-shadow: 0 8px 30px rgba(0, 168, 107, 0.1);
-                transform: translateY(-3px);
-            }
-            
-            /* --- BOTÕES --- */
-            .stButton>button {
-                border-radius: 8px;
-                border: 1px solid #00A86B;
-                background-color: transparent;
-                color: #00A86B;
-                font-weight: 600;
-                padding: 10px 16px;
-                transition: all 0.2s ease;
-            }
-            .stButton>button:hover {
-                background-color: #00A86B;
-                color: #FFFFFF;
-                border-color: #00A86B;
-            }
-            .stButton>button:focus {
-                box-shadow: 0 0 0 3px rgba(0, 168, 107, 0.5) !important;
-            }
-            .stButton>button[kind="primary"] { /* Botão de Ação Destrutiva (Remover) */
-                border-color: #C62828;
-                color: #C62828;
-            }
-             .stButton>button[kind="primary"]:hover {
-                background-color: #C62828;
-                color: white;
-            }
-
-            /* --- MÉTRICAS --- */
-            [data-testid="stMetric"] {
-                background-color: #1E1E1E;
-                border: 1px solid #2A2A2A;
-                border-radius: 12px;
-                padding: 20px;
-            }
-
-            /* --- INPUTS, SELECTBOX, TEXTAREA --- */
-            [data-testid="stTextInput"] input, 
-            [data-testid="stSelectbox"] div[data-baseweb="select"],
-            [data-testid="stTextArea"] textarea {
-                background-color: #2A2A2A;
-                border: 1px solid #444;
-                color: #E0E0E0;
-                border-radius: 8px;
-            }
+# O CSS fica em static/premium.css e é lido do disco uma única vez por processo.
+@st.cache_resource
+def read_custom_css():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "premium.css"), encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
 
-            /* --- POPOVER --- */
-            [data-testid="stPopover"] {
-                background-color: #2A2A2A;
-                border-radius: 8px;
-            }
-        </style>
-    """, unsafe_allow_html=True)
+def load_custom_css():
+    st.markdown(read_custom_css(), unsafe_allow_html=True)
 
 load_custom_css()
 
 
 # --- CONEXÃO COM FIREBASE (CACHEADO) ---
-@st.cache_resource
+@st.cache_resource(show_spinner=False)
 def init_firebase():
     """Inicializa a conexão com o Firebase de forma segura usando cache."""
+    # O cache_resource já garante uma execução por processo; o app só existirá aqui
+    # se o cache tiver sido limpo, e nesse caso não há por que reler as credenciais.
+    if firebase_admin._apps:
+        return firestore.client()
     try:
-        key_dict = json.loads(st.secrets["FIREBASE_SERVICE_ACCOUNT_KEY"])
-        creds = service_account.Credentials.from_service_account_info(key_dict)
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app(creds)
-    except (KeyError, json.JSONDecodeError) as e:
+        key_dict = orjson.loads(st.secrets["FIREBASE_SERVICE_ACCOUNT_KEY"])
+        firebase_admin.initialize_app(credentials.Certificate(key_dict))
+    except (KeyError, orjson.JSONDecodeError) as e:
         st.error("Erro fatal: Credenciais do Firebase não configuradas nos Segredos do Streamlit.")
         st.exception(e)
         st.stop()
     return firestore.client()
 
 # --- FUNÇÕES DE AUTENTICAÇÃO ---
+# Senhas novas usam argon2id; hashes bcrypt antigos continuam válidos e são
+# migrados para argon2id no primeiro login bem-sucedido. Da mesma forma, hashes argon2id
+# gerados com custos antigos são refeitos com os parâmetros atuais.
+# O bcrypt e o argon2 liberam o GIL durante o hash; rodá-los em threads dedicadas permite
+# que logins/cadastros simultâneos usem vários núcleos em vez de se enfileirarem.
+# Os recursos ficam em cache_resource porque o Streamlit reexecuta o script a cada interação.
+@st.cache_resource
+def get_hash_pool():
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="password-hash")
+
+# Custo do argon2id: por padrão os mínimos da OWASP (2 iterações, 19 MiB), ~50 ms num
+# núcleo do Streamlit Cloud; ajustável pelas variáveis de ambiente abaixo.
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", "19456"))
+
+@st.cache_resource
+def get_password_hasher():
+    return PasswordHasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_COST, parallelism=1)
+
 def hash_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return get_hash_pool().submit(get_password_hasher().hash, password).result()
+
+def check_password(password, hashed, scheme='argon2'):
+    if scheme == 'bcrypt':
+        # Hashes bcrypt antigos voltam do Firestore como bytes (Blob); aceita também texto.
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return get_hash_pool().submit(bcrypt.checkpw, password.encode('utf-8'), hashed).result()
+    try:
+        return get_hash_pool().submit(get_password_hasher().verify, hashed, password).result()
+    except (VerificationError, InvalidHashError):
+        return False
 
-def check_password(password, hashed):
-    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+@st.cache_resource
+def get_dummy_hash():
+    """Hash fixo usado quando o usuário não existe, para o login levar o mesmo tempo.
+
+    O dummy é argon2id, como as contas atuais. Contas bcrypt ainda não migradas (custo 12)
+    levam mais tempo para verificar e continuam distinguíveis pelo tempo até o primeiro
+    login, quando passam para argon2id; igualar esse caso exigiria pagar o bcrypt em todo login.
+    """
+    return hash_password("dummy-password")
+
+def get_user_doc(db, username):
+    """Lê o hash de senha do usuário, ou None se ele não existe.
+
+    Inexistentes não ficam em cache: pular a leitura deixaria nomes já testados mais rápidos
+    que contas reais, revelando pelo tempo quais usuários existem.
+    """
+    user_doc = db.collection('users').document(username).get(field_paths=['password', 'scheme'])
+    return user_doc if user_doc.exists else None
+
+def create_user(db, username, password):
+    """Cria a conta numa única chamada; retorna False se o nome já estiver em uso."""
+    try:
+        db.collection('users').document(username).create({'password': hash_password(password), 'scheme': 'argon2', 'created_at': firestore.SERVER_TIMESTAMP})
+    except AlreadyExists:
+        return False
+    return True
+
+def verify_login(user_doc, password):
+    """Valida a senha de um documento de usuário sem revelar, pelo tempo, se ele existe."""
+    user_data = user_doc.to_dict() if user_doc else {}
+    hashed = user_data.get('password')
+    if not hashed:
+        check_password(password, get_dummy_hash())
+        return False
+    scheme = user_data.get('scheme', 'bcrypt')
+    if not check_password(password, hashed, scheme):
+        return False
+    if scheme == 'bcrypt' or get_password_hasher().check_needs_rehash(hashed):
+        user_doc.reference.update({'password': hash_password(password), 'scheme': 'argon2'})
+    return True
+
+# Logins recentes: {usuário: (HMAC da senha, expiração)}. A chave do HMAC é aleatória e vive
+# só na memória do processo. Entrar de novo com a mesma senha dentro do prazo (ex.: após
+# "Sair da Conta") confere o HMAC em vez de repetir a leitura do Firestore e o argon2.
+VERIFIED_LOGIN_TTL = 300
+
+@st.cache_resource
+def get_verified_logins():
+    return secrets.token_bytes(32), {}
+
+def authenticate(db, username, password):
+    """Valida usuário e senha, reaproveitando uma verificação recente bem-sucedida."""
+    key, verified = get_verified_logins()
+    digest = hmac.new(key, password.encode('utf-8'), hashlib.sha256).digest()
+    now = time.time()
+    cached = verified.get(username)
+    if cached and cached[1] <= now:
+        verified.pop(username, None)
+    elif cached and hmac.compare_digest(cached[0], digest):
+        return True
+    if not verify_login(get_user_doc(db, username), password):
+        return False
+    # Remove os registros vencidos a cada inserção: o dicionário guarda só logins recentes.
+    for name, (_, expires) in list(verified.items()):
+        if expires <= now:
+            verified.pop(name, None)
+    verified[username] = (digest, now + VERIFIED_LOGIN_TTL)
+    return True
 
 # --- LÓGICA DE DADOS (COM CACHE) ---
+# Leituras independentes são disparadas em paralelo: o cliente gRPC libera o GIL
+# durante a chamada, então o tempo total é o da leitura mais lenta, não a soma.
+# O pool só recebe chamadas puras ao Firestore: funções com st.cache_data rodam na
+# thread do script, a única com o contexto de execução do Streamlit.
+@st.cache_resource
+def get_read_pool():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="firestore-read")
+
+# Cada coleção de cada usuário tem um contador de versão, incrementado após cada escrita.
+# Ele entra na chave dos caches abaixo, invalidando só os dados deste usuário em vez
+# de limpar o cache de todas as sessões com st.cache_data.clear(). Os contadores vivem
+# no processo, como o próprio st.cache_data: todas as sessões (abas, recarregamentos)
+# do mesmo usuário veem a mesma versão, e um número nunca volta a valer dados antigos.
+@st.cache_resource
+def get_version_store():
+    return threading.Lock(), {}
+
+def get_data_version(username, name):
+    return get_version_store()[1].get((username, name), 0)
+
+def bump_data_version(username, name):
+    lock, versions = get_version_store()
+    with lock:
+        versions[(username, name)] = versions.get((username, name), 0) + 1
+
+# Janela de histórico de hábitos usada nas análises (sequências, taxa e linha do tempo).
+HABIT_HISTORY_DAYS = 400
+
 @st.cache_data(ttl=300)
-def get_all_logs(_db, username):
-    logs_ref = _db.collection('users').document(username).collection('habits_log').stream()
-    return {doc.id: doc.to_dict() for doc in logs_ref}
+def get_all_logs(_db, username, version, since, until):
+    """Lê os registros de hábitos de `since` a `until` (%Y-%m-%d) dos agregados anuais.
+
+    Cada `aggregates/habits_log_<ano>` guarda, no mapa `days`, {dia: {hábito: concluído}}:
+    a janela de análise chega em uma leitura por ano que ela cobre (no máximo três), em vez
+    de um documento por dia, e nenhum documento cresce além de um ano de registros.
+    O mapa `days` é isento de indexação (firestore.indexes.json).
+    """
+    user_ref = _db.collection('users').document(username)
+    aggs = user_ref.collection('aggregates')
+    meta_ref = aggs.document('habits_log_meta')
+    year_refs = [aggs.document(f'habits_log_{year}') for year in range(int(since[:4]), int(until[:4]) + 1)]
+    snaps = {snap.id: snap for snap in _db.get_all([meta_ref] + year_refs)}
+    all_logs = {}
+    if snaps[meta_ref.id].exists:
+        for ref in year_refs:
+            all_logs.update((snaps[ref.id].to_dict() or {}).get('days', {}))
+    else:
+        # Migração única: monta os agregados da janela a partir dos documentos diários.
+        logs_col = user_ref.collection('habits_log')
+        days_by_year = {}
+        for doc in logs_col.where(filter=firestore.FieldFilter('__name__', '>=', logs_col.document(since))).stream():
+            days_by_year.setdefault(doc.id[:4], {})[doc.id] = all_logs[doc.id] = doc.to_dict()
+        batch = _db.batch()
+        for year, days in days_by_year.items():
+            batch.set(aggs.document(f'habits_log_{year}'), {'days': days}, merge=True)
+        batch.set(meta_ref, {'migrated_at': firestore.SERVER_TIMESTAMP})
+        batch.commit()
+    return {day: data for day, data in all_logs.items() if since <= day <= until}
+
+@st.cache_data(ttl=60)
+def get_daily_logs(_db, username, date_str, version):
+    """Lê os documentos do dia (hábitos e humor) numa única chamada."""
+    user_ref = _db.collection('users').document(username)
+    refs = [user_ref.collection(collection).document(date_str) for collection in ('habits_log', 'mood_log')]
+    return {snap.reference.parent.id: snap.to_dict() or {} for snap in _db.get_all(refs)}
+
+MOOD_HISTORY_PAGE_SIZE = 30
 
 @st.cache_data(ttl=300)
-def get_mood_logs(_db, username):
-    moods_ref = _db.collection('users').document(username).collection('mood_log').order_by("timestamp", direction=firestore.Query.DESCENDING).stream()
-    all_moods_data = [{'date': doc.id, **doc.to_dict()} for doc in moods_ref]
-    return all_moods_data
-
-def calculate_streaks(habit_logs, habit_name):
-    # (Lógica mantida, pois já é eficiente)
-    if not habit_logs: return 0, 0
-    dates_completed = {datetime.strptime(date, "%Y-%m-%d").date() for date, data in habit_logs.items() if data.get(habit_name)}
-    if not dates_completed: return 0, 0
-    sorted_dates = sorted(list(dates_completed))
-    longest_streak = 0
-    if sorted_dates:
-        current_longest_streak = 1
-        longest_streak = 1
-        for i in range(1, len(sorted_dates)):
-            if (sorted_dates[i] - sorted_dates[i-1]).days == 1:
-                current_longest_streak += 1
-            else:
-                current_longest_streak = 1
-            longest_streak = max(longest_streak, current_longest_streak)
-    current_streak = 0
-    today = datetime.now().date()
-    yesterday = today - timedelta(days=1)
-    check_date = today
-    if today not in dates_completed:
-        if yesterday in dates_completed:
-            check_date = yesterday
-        else:
-            return 0, longest_streak
-    while check_date in dates_completed:
-        current_streak += 1
-        check_date -= timedelta(days=1)
-    return current_streak, longest_streak
+def get_mood_logs(_db, username, before):
+    """Lê o humor dos dias anteriores a `before` (%Y-%m-%d) para os gráficos, sem o texto do diário.
+
+    Só o dia de hoje muda ao salvar; ele vem de get_daily_logs, então este histórico
+    não precisa ser relido a cada registro salvo.
+    """
+    moods_col = _db.collection('users').document(username).collection('mood_log')
+    moods_ref = (moods_col.where(filter=firestore.FieldFilter('__name__', '<', moods_col.document(before)))
+                 .select(['mood'])
+                 .stream())
+    return [{'date': doc.id, **doc.to_dict()} for doc in moods_ref]
 
-# --- COMPONENTES DE UI (ABAS DA APLICAÇÃO) ---
+@st.cache_data(ttl=300)
+def get_journal_page(_db, username, version, cursor):
+    """Lê uma página do diário, do mais recente ao mais antigo, após o `timestamp` do cursor."""
+    query = _db.collection('users').document(username).collection('mood_log').order_by("timestamp", direction=firestore.Query.DESCENDING)
+    if cursor is not None:
+        query = query.start_after({'timestamp': cursor})
+    return [{'date': doc.id, **doc.to_dict()} for doc in query.limit(MOOD_HISTORY_PAGE_SIZE).stream()]
+
+def get_journal_entries(db, username, version, pages):
+    """Junta as `pages` primeiras páginas; cada uma fica no cache, então "Carregar mais" lê só a nova."""
+    entries, cursor = [], None
+    for _ in range(pages):
+        page = get_journal_page(db, username, version, cursor)
+        entries += page
+        if len(page) < MOOD_HISTORY_PAGE_SIZE:
+            break
+        cursor = page[-1]['timestamp']
+    return entries
+
+# Cada coluna do Kanban lê só as suas tarefas mais recentes, para que a pilha de
+# concluídas não cresça sem limite. Requer o índice composto (tag, created_at desc) em tasks.
+KANBAN_PAGE_SIZE = 50
+
+def fetch_column_tasks(tasks_ref, tag, limit):
+    """Lê as `limit` tarefas mais recentes de uma coluna, em ordem de criação, e se há mais."""
+    query = (tasks_ref.where(filter=firestore.FieldFilter('tag', '==', tag))
+             .order_by("created_at", direction=firestore.Query.DESCENDING)
+             .limit(limit + 1))
+    tasks = [{'id': doc.id, **doc.to_dict()} for doc in query.stream()]
+    return tasks[:limit][::-1], len(tasks) > limit
+
+@st.cache_data(ttl=60)
+def get_kanban_columns(_db, username, version, tags, limit):
+    """Lê as colunas do Kanban com uma consulta por status, disparadas em paralelo no pool."""
+    tasks_ref = _db.collection('users').document(username).collection('tasks')
+    futures = {tag: get_read_pool().submit(fetch_column_tasks, tasks_ref, tag, limit) for tag in tags}
+    return {tag: future.result() for tag, future in futures.items()}
+
+@st.cache_resource(max_entries=1000)
+def get_user_refs(_db, username, date_str):
+    """Referências do Firestore usadas a cada rerun, montadas uma vez por usuário e dia."""
+    user_ref = _db.collection('users').document(username)
+    return {
+        'user': user_ref,
+        'tasks': user_ref.collection('tasks'),
+        'habits_today': user_ref.collection('habits_log').document(date_str),
+        'habits_agg': user_ref.collection('aggregates').document(f'habits_log_{date_str[:4]}'),
+        'mood_today': user_ref.collection('mood_log').document(date_str),
+    }
+
+@st.cache_data(ttl=300)
+def get_habits_list(_user_ref, username, version):
+    """Lê os hábitos do mapa `habits` no documento do usuário, numa única leitura."""
+    habits = (_user_ref.get(field_paths=['habits']).to_dict() or {}).get('habits')
+    if habits is None:
+        # Migração única: contas antigas guardavam um documento por hábito em habits_config.
+        habits = {doc.id: doc.to_dict() for doc in _user_ref.collection('habits_config').stream()}
+        _user_ref.set({'habits': habits}, merge=True)
+    return sorted(habits)
+
+def get_today_key():
+    """Retorna a data de hoje (%Y-%m-%d), formatada só uma vez por dia e por sessão."""
+    now = time.localtime()
+    bucket = (now.tm_year, now.tm_yday)
+    if st.session_state.get('_day_bucket') != bucket:
+        st.session_state['_day_bucket'] = bucket
+        st.session_state['_day_str'] = date(now.tm_year, now.tm_mon, now.tm_mday).isoformat()
+    return st.session_state['_day_str']
+
+def calculate_streaks(completed, today):
+    """Calcula a sequência atual e a maior sequência a partir das datas concluídas (%Y-%m-%d), com NumPy."""
+    if not completed: return 0, 0
+    # NumPy, pandas e Plotly são importados sob demanda: a tela de login e contas
+    # sem histórico não pagam o custo de importação dessas bibliotecas.
+    import numpy as np
+    # Dias concluídos, ordenados e sem repetição, como inteiros (dias desde a época).
+    # O NumPy lê datas ISO diretamente, sem passar pelo pandas.
+    days = np.unique(np.array(completed, dtype='datetime64[D]').astype(np.int64))
+    # Cada quebra (diferença > 1 dia) encerra uma sequência.
+    breaks = np.flatnonzero(np.diff(days) != 1)
+    run_starts = np.concatenate(([0], breaks + 1))
+    run_ends = np.concatenate((breaks, [len(days) - 1]))
+    longest_streak = int((run_ends - run_starts).max()) + 1
+    # A sequência atual termina hoje ou ontem; senão, é zero.
+    today_day = np.datetime64(today, 'D').astype(np.int64)
+    last = np.searchsorted(days, today_day, side='right') - 1
+    if last < 0 or today_day - days[last] > 1:
+        return 0, longest_streak
+    run = np.searchsorted(run_ends, last)
+    return int(last - run_starts[run]) + 1, longest_streak
+
+@st.cache_data(ttl=300)
+def get_streaks(_completed_dates, username, habit_name, version, today):
+    """Memoiza calculate_streaks; as datas ficam fora da chave, identificadas pela versão e pelo dia."""
+    return calculate_streaks(_completed_dates, today)
+
+@st.cache_resource
+def get_dark_layout():
+    """Layout escuro e transparente comum a todos os gráficos, com o template já resolvido."""
+    import plotly.graph_objects as go
+    return go.Layout(template='plotly_dark', paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+
+@st.cache_data(ttl=300)
+def get_mood_summary(_all_moods_data, username, version, period_days, today):
+    """Humor mais frequente e gráfico de distribuição do período, ou None se não há registros.
+
+    Como em get_streaks, os registros ficam fora da chave: a versão de humor os identifica.
+    """
+    import pandas as pd
+    import plotly.graph_objects as go
+    # Uma Series categórica tipada, montada de uma vez a partir das duas colunas: o domínio
+    # fixo de MOOD_OPTIONS faz a contagem sair dos códigos inteiros. Humores desconhecidos
+    # são descartados antes, e o índice de datas ordenado torna o período um fatiamento.
+    records = [(data['date'], data['mood']) for data in _all_moods_data if data.get('mood') in MOOD_MAP]
+    if not records:
+        return None
+    dates, moods = zip(*records)
+    moods = pd.Series(pd.Categorical(moods, categories=MOOD_OPTIONS), index=pd.to_datetime(dates, format="%Y-%m-%d")).sort_index()
+    if period_days:
+        moods = moods.loc[pd.Timestamp(today) - pd.Timedelta(days=period_days - 1):]
+
+    mood_counts = moods.value_counts()
+    mood_counts = mood_counts[mood_counts > 0]
+    if mood_counts.empty:
+        return None
+    fig_pie = go.Figure(go.Pie(labels=mood_counts.index.to_list(), values=mood_counts.to_numpy(), hole=.4,
+                               textposition='inside', textinfo='percent+label'))
+    fig_pie.update_layout(get_dark_layout(), title="Distribuição de Humor", showlegend=False)
+    return mood_counts.idxmax(), fig_pie
+
+@st.cache_data(ttl=3600)
+def get_habit_heatmap(_completed_dates, username, habit_name, version, today):
+    """Monta a linha do tempo semanal de um hábito; como em get_streaks, as datas ficam fora da chave."""
+    import numpy as np
+    import plotly.graph_objects as go
+    # Grade semanal (dia da semana × semana) montada direto no NumPy: o vetor de dias,
+    # a partir da segunda-feira da primeira semana, vira uma matriz 7 × semanas.
+    first_day = date.fromisoformat(min(_completed_dates))
+    start = first_day - timedelta(days=first_day.weekday())
+    n_weeks = (today - start).days // 7 + 1
+    grid = np.zeros(n_weeks * 7)
+    grid[(today - start).days + 1:] = np.nan  # dias ainda por vir na semana atual
+    offsets = (np.array(_completed_dates, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+    grid[offsets[offsets <= (today - start).days]] = 1  # datas depois de hoje ficam fora da grade
+    week_starts = np.datetime64(start, 'D') + 7 * np.arange(n_weeks)
+
+    fig = go.Figure(go.Heatmap(z=grid.reshape(n_weeks, 7).T, x=week_starts.astype(str), y=WEEKDAYS,
+                               colorscale='Greens', zmin=0, zmax=1, showscale=False, xgap=2, ygap=2))
+    fig.update_layout(get_dark_layout(), title=f'Linha do Tempo de "{habit_name}"', yaxis_autorange='reversed')
+    return fig
 
+# --- COMPONENTES DE UI (ABAS DA APLICAÇÃO) ---
+MOOD_MAP = {"Excelente": "😄", "Bem": "🙂", "Normal": "😐", "Mal": "😕", "Terrível": "😢"}
+MOOD_OPTIONS = tuple(MOOD_MAP)
+TAGS = ("📌 A Fazer", "⚙️ Em Progresso", "✅ Concluído")
+MOOD_PERIODS = {"Últimos 30 dias": 30, "Últimos 90 dias": 90, "Todo o período": None}
+WEEKDAYS = ("Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom")
+
+# Cada aba é um fragmento: interações dentro dela reexecutam só a própria aba,
+# sem refazer as leituras do Firestore das outras.
+@st.fragment
 def render_habits_and_tasks(db, username):
     st.header("🎯 Hábitos e Tarefas")
     st.write("Construa sua disciplina e organize suas metas com ferramentas visuais.")
@@ -210,58 +408,75 @@ def render_habits_and_tasks(db, username):
 
     st.subheader("💪 Monitoramento de Hábitos")
     
-    habits_ref = db.collection('users').document(username).collection('habits_config')
-    habits_list = [doc.id for doc in habits_ref.stream()]
+    # A data vem de dentro do fragmento: seus reruns reaproveitam os argumentos da última
+    # execução completa, que ficariam no dia anterior após a meia-noite.
+    today_str = get_today_key()
+    today = date.fromisoformat(today_str)
+    refs = get_user_refs(db, username, today_str)
+    user_ref = refs['user']
+    habits_list = get_habits_list(user_ref, username, get_data_version(username, 'habit_config'))
 
     with st.expander("⚙️ Gerenciar Meus Hábitos"):
         with st.form("new_habit_form", clear_on_submit=True):
             new_habit = st.text_input("Adicionar novo hábito:")
             if st.form_submit_button("Adicionar Hábito"):
                 if new_habit and new_habit not in habits_list:
-                    habits_ref.document(new_habit).set({'created_at': firestore.SERVER_TIMESTAMP})
+                    user_ref.set({'habits': {new_habit: {'created_at': firestore.SERVER_TIMESTAMP}}}, merge=True)
                     st.success(f"Hábito '{new_habit}' adicionado!")
-                    st.cache_data.clear()
-                    st.rerun()
+                    bump_data_version(username, 'habit_config')
+                    st.rerun(scope="fragment")
         
         if habits_list:
             habit_to_delete = st.selectbox("Remover um hábito:", [""] + habits_list)
             if st.button("Remover Hábito", type="primary"):
                 if habit_to_delete:
-                    habits_ref.document(habit_to_delete).delete()
+                    user_ref.update({firestore.FieldPath('habits', habit_to_delete).to_api_repr(): firestore.DELETE_FIELD})
                     st.warning(f"Hábito '{habit_to_delete}' removido.")
-                    st.cache_data.clear()
-                    st.rerun()
+                    bump_data_version(username, 'habit_config')
+                    st.rerun(scope="fragment")
 
     if not habits_list:
         st.info("Adicione seu primeiro hábito em 'Gerenciar Meus Hábitos' para começar.")
         return
 
     st.markdown("##### **Registro de Hoje**")
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    today_log_ref = db.collection('users').document(username).collection('habits_log').document(today_str)
-    today_log_data = today_log_ref.get().to_dict() or {}
-
-    cols = st.columns(len(habits_list) if habits_list else 1)
-    for i, habit in enumerate(habits_list):
-        with cols[i]:
-            is_done = st.checkbox(habit, value=today_log_data.get(habit, False), key=f"habit_{habit}")
-            if is_done != today_log_data.get(habit, False):
-                today_log_ref.set({habit: is_done}, merge=True)
-                st.cache_data.clear()
-                st.rerun()
+    today_log_ref = refs['habits_today']
+    today_log_data = get_daily_logs(db, username, today_str, (get_data_version(username, 'habits'), get_data_version(username, 'moods'))).get('habits_log', {})
+
+    # Os checkboxes ficam num formulário: marcar vários hábitos não dispara reruns,
+    # e o envio grava só as diferenças num único commit.
+    with st.form("today_habits_form"):
+        checked = {}
+        cols = st.columns(len(habits_list) if habits_list else 1)
+        for i, habit in enumerate(habits_list):
+            with cols[i]:
+                checked[habit] = st.checkbox(habit, value=today_log_data.get(habit, False), key=f"habit_{habit}")
+        habits_submitted = st.form_submit_button("Salvar Hábitos de Hoje")
+    if habits_submitted:
+        pending_writes = {habit: is_done for habit, is_done in checked.items() if is_done != today_log_data.get(habit, False)}
+        if pending_writes:
+            # Sem st.rerun(): o checkbox já exibe o novo valor e a análise abaixo relê os dados com a nova versão.
+            batch = db.batch()
+            batch.set(today_log_ref, pending_writes, merge=True)
+            batch.set(refs['habits_agg'], {'days': {today_str: pending_writes}}, merge=True)
+            batch.commit()
+            bump_data_version(username, 'habits')
 
     st.markdown("##### **Análise e Histórico**")
     selected_habit = st.selectbox("Selecione um hábito para analisar:", habits_list)
 
     if selected_habit:
-        all_logs = get_all_logs(db, username)
-        current_streak, longest_streak = calculate_streaks(all_logs, selected_habit)
+        habits_version = get_data_version(username, 'habits')
+        all_logs = get_all_logs(db, username, habits_version, (today - timedelta(days=HABIT_HISTORY_DAYS)).isoformat(), today.isoformat())
         completed_dates = [date for date, data in all_logs.items() if data.get(selected_habit)]
+        # Hábito nunca marcado na janela: não há sequência a calcular nem cache a consultar.
+        current_streak, longest_streak = get_streaks(completed_dates, username, selected_habit, habits_version, today) if completed_dates else (0, 0)
         
         total_days_tracked = 0
         if completed_dates:
-             first_day = min([datetime.strptime(d, "%Y-%m-%d") for d in completed_dates])
-             total_days_tracked = (datetime.now() - first_day).days + 1
+             # Datas ISO ordenam como texto, então basta converter a menor delas.
+             first_day = date.fromisoformat(min(completed_dates))
+             total_days_tracked = (today - first_day).days + 1
         
         completion_rate = (len(completed_dates) / total_days_tracked) * 100 if total_days_tracked > 0 else 0
 
@@ -271,100 +486,108 @@ def render_habits_and_tasks(db, username):
         c3.metric("📈 Taxa de Conclusão", f"{completion_rate:.1f}%")
 
         if completed_dates:
-            df = pd.DataFrame({'date': pd.to_datetime(completed_dates), 'completed': 1}).set_index('date')
-            all_days = pd.date_range(start=df.index.min() - timedelta(days=1), end=datetime.now(), freq='D')
-            calendar_data = df.reindex(all_days, fill_value=0)
-            
-            fig = px.imshow([calendar_data['completed'].values],
-                            labels=dict(x="Dia", y="Hábito", color="Completado"),
-                            color_continuous_scale='Greens',
-                            title=f'Linha do Tempo de "{selected_habit}"')
-            fig.update_layout(template='plotly_dark', paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-            st.plotly_chart(fig, use_container_width=True)
+            fig = get_habit_heatmap(completed_dates, username, selected_habit, habits_version, today)
+            # Gráfico estático: sem zoom/hover, o Plotly no navegador só desenha a grade.
+            st.plotly_chart(fig, use_container_width=True, config={'staticPlot': True})
 
 
     st.divider()
 
     st.subheader("📝 Quadro Kanban de Tarefas")
-    tasks_ref = db.collection('users').document(username).collection('tasks')
-    tags = ["📌 A Fazer", "⚙️ Em Progresso", "✅ Concluído"]
+    if kanban_warning := st.session_state.pop('_kanban_warning', None):
+        st.warning(kanban_warning)
+    tasks_ref = refs['tasks']
     
     with st.form("new_task_form", clear_on_submit=True):
         c1, c2 = st.columns([3,1])
         new_task_text = c1.text_input("Nova Tarefa:", label_visibility="collapsed", placeholder="Ex: Estudar Machine Learning por 1 hora...")
-        new_task_tag = c2.selectbox("Status:", tags, label_visibility="collapsed")
+        new_task_tag = c2.selectbox("Status:", TAGS, label_visibility="collapsed")
         if st.form_submit_button("＋ Adicionar Tarefa"):
             if new_task_text:
                 tasks_ref.add({'task': new_task_text, 'tag': new_task_tag, 'created_at': firestore.SERVER_TIMESTAMP})
-                st.rerun()
+                bump_data_version(username, 'tasks')
+                st.rerun(scope="fragment")
             
-    cols = st.columns(len(tags))
-    tasks_by_tag = {tag: [task for task in tasks_ref.where('tag', '==', tag).order_by("created_at").stream()] for tag in tags}
-            
-    for i, tag in enumerate(tags):
-        with cols[i]:
-            st.markdown(f"##### {tag}")
-            for task in tasks_by_tag[tag]:
-                task_data = task.to_dict()
-                with st.container(border=True):
-                    c1, c2 = st.columns([0.85, 0.15])
-                    c1.write(task_data['task'])
-                    with c2.popover("⋮"):
-                        new_tag = st.selectbox("Mover:", tags, index=i, key=f"tag_{task.id}", label_visibility="collapsed")
-                        if st.button("Remover", key=f"del_{task.id}", use_container_width=True, type="primary"):
-                            tasks_ref.document(task.id).delete()
-                            st.rerun()
-                    if new_tag != tag:
-                        tasks_ref.document(task.id).update({'tag': new_tag})
-                        st.rerun()
+    tasks_limit = KANBAN_PAGE_SIZE * st.session_state.get('kanban_pages', 1)
+    columns = get_kanban_columns(db, username, get_data_version(username, 'tasks'), TAGS, tasks_limit)
+    tasks_by_tag = {tag: tasks for tag, (tasks, _) in columns.items()}
+    if not any(tasks_by_tag[tag] for tag in TAGS):
+        return
 
+    # O quadro é só HTML (um elemento por coluna); as ações ficam num único formulário
+    # abaixo, gravado num WriteBatch com um só rerun.
+    cols = st.columns(len(TAGS))
+    for i, tag in enumerate(TAGS):
+        cards = "".join(f'<div class="kanban-card">{html.escape(task["task"])}</div>' for task in tasks_by_tag[tag])
+        cols[i].markdown(f"##### {tag}\n{cards}", unsafe_allow_html=True)
+    if any(has_more for _, has_more in columns.values()) and st.button("Mostrar mais tarefas", use_container_width=True):
+        st.session_state.kanban_pages = st.session_state.get('kanban_pages', 1) + 1
+        st.rerun(scope="fragment")
+
+    task_labels = {task['id']: f"{tag.split()[0]} {task['task']}" for tag in TAGS for task in tasks_by_tag[tag]}
+    remove_action = "🗑️ Remover"
+    with st.form("kanban_form", clear_on_submit=True):
+        c1, c2 = st.columns([3, 1])
+        selected_tasks = c1.multiselect("Tarefas:", list(task_labels), format_func=task_labels.get, label_visibility="collapsed", placeholder="Selecione tarefas para mover ou remover...")
+        action = c2.selectbox("Ação:", TAGS + (remove_action,), label_visibility="collapsed")
+        kanban_submitted = st.form_submit_button("Aplicar", use_container_width=True)
+    if kanban_submitted and selected_tasks:
+        batch = db.batch()
+        for task_id in selected_tasks:
+            if action == remove_action:
+                batch.delete(tasks_ref.document(task_id))
+            else:
+                batch.update(tasks_ref.document(task_id), {'tag': action})
+        try:
+            batch.commit()
+        except NotFound:
+            # Alguma tarefa foi removida em outra aba; o lote inteiro é descartado e o quadro relido.
+            # O aviso sobrevive ao rerun pela sessão e é exibido acima do quadro.
+            st.session_state['_kanban_warning'] = "Uma das tarefas selecionadas não existe mais. O quadro foi atualizado; tente novamente."
+        bump_data_version(username, 'tasks')
+        st.rerun(scope="fragment")
+
+@st.fragment
 def render_mood(db, username):
     st.header("😊 Análise de Humor")
     st.write("Entenda seus padrões emocionais e reflita sobre seu dia.")
     st.divider()
+    # Como em render_habits_and_tasks, a data é obtida dentro do fragmento.
+    today_str = get_today_key()
+    today = date.fromisoformat(today_str)
     
     col1, col2 = st.columns([1, 1])
 
     with col1:
         st.subheader("✍️ Registro de Hoje")
-        today_str = datetime.now().strftime("%Y-%m-%d")
-        mood_log_ref = db.collection('users').document(username).collection('mood_log').document(today_str)
-        mood_log_data = mood_log_ref.get().to_dict() or {}
-        mood_map = {"Excelente": "😄", "Bem": "🙂", "Normal": "😐", "Mal": "😕", "Terrível": "😢"}
-        mood_options = list(mood_map.keys())
+        mood_log_ref = get_user_refs(db, username, today_str)['mood_today']
+        mood_log_data = get_daily_logs(db, username, today_str, (get_data_version(username, 'habits'), get_data_version(username, 'moods'))).get('mood_log', {})
         current_mood = mood_log_data.get('mood', '')
-        selected_mood = st.radio("Como você se sente?", options=mood_options, index=mood_options.index(current_mood) if current_mood else 0, format_func=lambda x: f"{mood_map.get(x, '')} {x}")
+        today_mood = current_mood
+        selected_mood = st.radio("Como você se sente?", options=MOOD_OPTIONS, index=MOOD_OPTIONS.index(current_mood) if current_mood else 0, format_func=lambda x: f"{MOOD_MAP.get(x, '')} {x}")
         journal_entry = st.text_area("Diário:", value=mood_log_data.get('journal', ''), height=200, placeholder="O que está em sua mente?")
         if st.button("Salvar Registro", type="primary", use_container_width=True):
-            mood_log_ref.set({'mood': selected_mood, 'journal': journal_entry, 'timestamp': firestore.SERVER_TIMESTAMP}, merge=True)
+            # Envia apenas os campos alterados; o merge preserva o restante do documento.
+            changes = {k: v for k, v in (('mood', selected_mood), ('journal', journal_entry)) if mood_log_data.get(k) != v}
+            if changes:
+                mood_log_ref.set({**changes, 'timestamp': firestore.SERVER_TIMESTAMP}, merge=True)
+                bump_data_version(username, 'moods')
+            today_mood = selected_mood
             st.success("Registro salvo!")
-            st.cache_data.clear()
-            st.rerun()
 
-    all_moods_data = get_mood_logs(db, username)
+    # Histórico em cache + o registro de hoje já conhecido: salvar não relê todos os dias.
+    all_moods_data = get_mood_logs(db, username, today_str) + ([{'date': today_str, 'mood': today_mood}] if today_mood else [])
     with col2:
         st.subheader("📊 Gráficos e Insights")
         if all_moods_data:
-            df = pd.DataFrame(all_moods_data)
-            df['date'] = pd.to_datetime(df['date'])
-            
             # NOVO: Filtro interativo para os gráficos
-            date_filter = st.selectbox("Analisar período:", ["Últimos 30 dias", "Últimos 90 dias", "Todo o período"])
-            today = pd.to_datetime(datetime.now().date())
-            if date_filter == "Últimos 30 dias":
-                df = df[df['date'] > (today - pd.Timedelta(days=30))]
-            elif date_filter == "Últimos 90 dias":
-                df = df[df['date'] > (today - pd.Timedelta(days=90))]
-
-            if not df.empty:
+            date_filter = st.selectbox("Analisar período:", tuple(MOOD_PERIODS))
+            mood_summary = get_mood_summary(all_moods_data, username, get_data_version(username, 'moods'), MOOD_PERIODS[date_filter], today)
+
+            if mood_summary:
+                most_frequent_mood, fig_pie = mood_summary
                 c1, c2 = st.columns(2)
-                most_frequent_mood = df['mood'].mode()[0]
-                c1.metric("Humor Frequente", f"{mood_map.get(most_frequent_mood, '❓')} {most_frequent_mood}")
-                
-                mood_counts = df['mood'].value_counts()
-                fig_pie = px.pie(mood_counts, values=mood_counts.values, names=mood_counts.index, title="Distribuição de Humor", hole=.4)
-                fig_pie.update_layout(template='plotly_dark', paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', showlegend=False)
-                fig_pie.update_traces(textposition='inside', textinfo='percent+label')
+                c1.metric("Humor Frequente", f"{MOOD_MAP.get(most_frequent_mood, '❓')} {most_frequent_mood}")
                 st.plotly_chart(fig_pie, use_container_width=True)
             else:
                  st.info("Nenhum registro no período selecionado.")
@@ -374,12 +597,27 @@ def render_mood(db, username):
     st.divider()
     st.subheader("🗓️ Histórico do Diário")
     if all_moods_data:
-        for data in all_moods_data:
-            with st.expander(f"**{data['date']}** - Humor: {mood_map.get(data.get('mood'), '❓')} **{data.get('mood', 'N/A')}**"):
-                st.write(f"*{data.get('journal', 'Nenhum diário escrito.')}*")
+        import pandas as pd
+        # Histórico paginado: só as páginas já abertas são lidas e renderizadas.
+        history_pages = st.session_state.get('mood_pages', 1)
+        history_limit = MOOD_HISTORY_PAGE_SIZE * history_pages
+        # Uma única tabela em vez de um expander por dia: um só elemento na página.
+        history_df = pd.DataFrame([
+            {
+                'Data': data['date'],
+                'Humor': f"{MOOD_MAP.get(data.get('mood'), '❓')} {data.get('mood', 'N/A')}",
+                'Diário': data.get('journal') or 'Nenhum diário escrito.',
+            }
+            for data in get_journal_entries(db, username, get_data_version(username, 'moods'), history_pages)
+        ])
+        st.dataframe(history_df, use_container_width=True, hide_index=True)
+        if len(all_moods_data) > history_limit and st.button("Carregar mais", use_container_width=True):
+            st.session_state.mood_pages = st.session_state.get('mood_pages', 1) + 1
+            st.rerun(scope="fragment")
     else:
         st.write("Seu histórico de diário aparecerá aqui.")
 
+@st.fragment
 def render_future_upgrades(db):
     st.header("🚀 Futuros Upgrades")
     st.info("Sua opinião é fundamental! Ajude a moldar o futuro do app.")
@@ -387,6 +625,7 @@ def render_future_upgrades(db):
         suggestion = st.text_area("Sua ideia:", placeholder="Gostaria de uma funcionalidade para...")
         if st.form_submit_button("Enviar Sugestão", use_container_width=True):
             if suggestion:
+                # Escrita síncrona: é uma única chamada, e o agradecimento só aparece se ela der certo.
                 db.collection('suggestions').add({'suggestion': suggestion, 'user': st.session_state.username,'timestamp': firestore.SERVER_TIMESTAMP})
                 st.success("Obrigado pela sua sugestão!")
                 st.balloons()
@@ -399,11 +638,14 @@ def main_app(db, username):
     if st.sidebar.button("Sair da Conta", use_container_width=True, type="primary"):
         st.session_state.logged_in = False
         st.session_state.username = ""
-        st.cache_data.clear()
+        # Os caches são por usuário e não precisam ser limpos; só a paginação desta sessão volta ao início.
+        for key in ('mood_pages', 'kanban_pages'):
+            st.session_state.pop(key, None)
         st.rerun()
     
+    today = date.fromisoformat(get_today_key())
     st.title("📓 Meu Diário Pessoal")
-    st.caption(f"Bem-vindo ao seu centro de produtividade e autoconhecimento.  |  Data: {datetime.now().strftime('%d/%m/%Y')}")
+    st.caption(f"Bem-vindo ao seu centro de produtividade e autoconhecimento.  |  Data: {today.strftime('%d/%m/%Y')}")
     
     tab1, tab2, tab3 = st.tabs(["**🎯 Hábitos e Tarefas**", "**😊 Análise de Humor**", "**🚀 Futuros Upgrades**"])
 
@@ -427,20 +669,18 @@ def login_screen(db):
                 if not username or not password:
                     st.error("Por favor, preencha todos os campos.")
                 elif choice == "Login":
-                    user_doc = db.collection('users').document(username).get()
-                    if user_doc.exists and check_password(password, user_doc.to_dict().get('password')):
+                    if authenticate(db, username, password):
                         st.session_state.logged_in = True
                         st.session_state.username = username
                         st.rerun()
                     else:
                         st.error("Usuário ou senha inválidos.")
                 elif choice == "Cadastrar":
-                    if db.collection('users').document(username).get().exists:
-                        st.error("Este nome de usuário já existe.")
-                    else:
-                        db.collection('users').document(username).set({'password': hash_password(password), 'created_at': firestore.SERVER_TIMESTAMP})
+                    if create_user(db, username, password):
                         st.success("Conta criada! Agora você pode fazer o login.")
                         st.balloons()
+                    else:
+                        st.error("Este nome de usuário já existe.")
     with col2:
         st.write("") # Espaçamento
         st.image("https://storage.googleapis.com/gemini-prod/images/496739a8-7966-4d0f-8c08-164134887569.png", use_column_width=True)